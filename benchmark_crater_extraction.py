@@ -0,0 +1,89 @@
+#############################
+#BENCHMARK_CRATER_EXTRACTION#
+#############################
+# Compares crater extraction backends (see utils/crater_extractors.py) on the custom loss set (Dev_rings_for_loss/),
+# in terms of speed and recall. The exhaustive template match ('template') is the reference. For every backend we report:
+# - the mean time per image and the speedup relative to the reference
+# - the recall against the csv craters (N_match/N_csv), same as the custom loss during training
+# - the fraction of the reference's detections that are recovered by the backend
+# Predictions are generated once with a trained model and then loaded from the prediction cache (utils/prediction_cache.py).
+#####################################################
+
+import time
+import numpy as np
+
+from utils.prediction_cache import cached_predict
+from utils.crater_extractors import get_extractor
+
+def match_fraction(coords, ref_coords, match_thresh2=50):
+    #fraction of ref_coords that have a counterpart in coords, within match_thresh2
+    if len(ref_coords) == 0:
+        return 1.
+    if len(coords) == 0:
+        return 0.
+    N = 0
+    for rc in ref_coords:
+        diffsum = np.sum((coords - rc)**2, axis=1)
+        if np.min(diffsum) < match_thresh2:
+            N += 1
+    return float(N)/float(len(ref_coords))
+
+def get_predictions(dir,modelpath,cache_dir,inv_color,rescale,n_imgs):
+    custom_loss_path = '%s/Dev_rings_for_loss'%dir
+    loss_csvs = np.load('%s/custom_loss_csvs.npy'%custom_loss_path)[:n_imgs]
+    loss_data = np.load('%s/custom_loss_images.npy'%custom_loss_path, mmap_mode='r')[:n_imgs]
+    pred = cached_predict(modelpath, loss_data, inv_color, rescale, cache_dir=cache_dir)
+    return pred, loss_csvs
+
+def benchmark_extraction(pred,loss_csvs,backends):
+    #backends - list of extractor names, first entry is the reference
+    match_thresh2 = 50
+    results = {}
+    ref_coords = []
+    for name in backends:
+        extract_craters = get_extractor(name)
+        times, recall, ref_frac = [], [], []
+        for i in range(len(pred)):
+            t0 = time.time()
+            coords = extract_craters(pred[i].copy(), match_thresh2)
+            times.append(time.time() - t0)
+
+            if name == backends[0]:
+                ref_coords.append(coords)
+            ref_frac.append(match_fraction(coords, ref_coords[i], match_thresh2))
+
+            #recall against csv
+            csv_coords, N_match = loss_csvs[i], 0
+            for tc in coords:
+                if len(csv_coords) == 0:
+                    break
+                index = np.sum((csv_coords - tc)**2, axis=1) > match_thresh2
+                N_match += len(np.where(index==False)[0])
+                csv_coords = csv_coords[index]
+            if len(loss_csvs[i]) > 0:
+                recall.append(float(N_match)/float(len(loss_csvs[i])))
+        results[name] = (np.mean(times), np.mean(recall), np.mean(ref_frac))
+
+    t_ref = results[backends[0]][0]
+    print "%-25s %15s %10s %15s %25s"%("backend","time/img (s)","speedup","recall (csv)","fraction of reference")
+    for name in backends:
+        t, rec, frac = results[name]
+        print "%-25s %15.4f %10.2f %15.4f %25.4f"%(name, t, t_ref/t, rec, frac)
+    return results
+
+################
+#Arguments, Run#
+########################################################################
+if __name__ == '__main__':
+    #args
+    dir = 'dataset'         #location of Dev_rings_for_loss/ folder. Don't include final '/' in path
+    modelpath = 'models/unet_s256_rings.h5'
+    cache_dir = 'models/pred_cache' #predictions are cached here by model/input/settings (utils/prediction_cache.py)
+    inv_color = 1           #**must be same setting as what model was trained on**
+    rescale = 1             #**must be same setting as what model was trained on**
+    n_imgs = 100            #number of custom loss images to benchmark on
+
+    backends = ['template', 'template_pyramid', 'template_roi', 'hough']  #backends to benchmark, first one is the reference
+
+    pred, loss_csvs = get_predictions(dir,modelpath,cache_dir,inv_color,rescale,n_imgs)
+    benchmark_extraction(pred,loss_csvs,backends)
@@ -0,0 +1,105 @@
+####################
+#BENCHMARK_PIPELINE#
+####################
+# End-to-end CPU throughput benchmark that needs no dataset and no trained weights. Synthetic ring tiles go through
+# every stage of the pipeline, with a small randomly initialized U-Net (utils/unet_model.py):
+# - preprocess: rescale_and_invcolor
+# - generator:  custom_image_generator (augmentation, block shuffling)
+# - train:      train_on_batch on the generator batches
+# - predict:    model.predict
+# - extract:    crater extraction (utils/crater_extractors.py)
+# For every stage we report images/sec and the p50/p90/p99 latency per call (batch, or image for extraction).
+# Run it before and after a change to catch throughput regressions in any of the stages.
+#####################################################
+
+import time
+import numpy as np
+import cv2
+
+from utils.rescale_invcolor import *
+from utils.unet_model import unet_model
+from utils.crater_extractors import get_extractor
+from run_moon_convnet_model import custom_image_generator
+
+def make_synthetic_tiles(n, dim, n_craters=20, minrad=3, maxrad=40, seed=42):
+    #moon-like tiles (noisy background with darker crater floors) and their ring targets, normalized 0-1 like the data
+    rng = np.random.RandomState(seed)
+    data = np.zeros((n,dim,dim,1), dtype='float32')
+    target = np.zeros((n,dim,dim), dtype='float32')
+    for i in range(n):
+        img = 0.5 + 0.1*rng.randn(dim,dim)
+        for j in range(n_craters):
+            x, y, r = rng.randint(0,dim), rng.randint(0,dim), rng.randint(minrad,maxrad+1)
+            cv2.circle(img, (x,y), r, 0.5 - 0.3*rng.rand(), -1)
+            cv2.circle(target[i], (x,y), r, 1, 1)
+        data[i,:,:,0] = np.clip(img, 0.01, 1)
+    return data, target
+
+def time_calls(f, args):
+    #calls f on each element of args, returns the outputs and the time of each call
+    out, times = [], []
+    for a in args:
+        t0 = time.time()
+        out.append(f(a))
+        times.append(time.time() - t0)
+    return out, times
+
+def print_results(results, stages):
+    print "%-12s %8s %8s %12s %10s %10s %10s"%("stage","images","calls","images/sec","p50 (ms)","p90 (ms)","p99 (ms)")
+    for name in stages:
+        n_imgs, times = results[name]
+        p50, p90, p99 = np.percentile(times, [50,90,99])*1000
+        print "%-12s %8d %8d %12.2f %10.2f %10.2f %10.2f"%(name, n_imgs, len(times), n_imgs/np.sum(times), p50, p90, p99)
+
+def benchmark_pipeline(n_imgs,dim,batch_size,n_train_steps,n_filters,depth,extractor,extract_input,inv_color,rescale):
+    results = {}
+    data, target = make_synthetic_tiles(n_imgs, dim)
+    batches = range(0, n_imgs, batch_size)
+
+    # preprocess, per batch
+    _, times = time_calls(lambda i: rescale_and_invcolor(data[i:i+batch_size], inv_color, rescale), batches)
+    results['preprocess'] = (n_imgs, times)
+
+    # generator, n_train_steps batches
+    gen = custom_image_generator(data, target, batch_size=batch_size, shuffle=1)
+    train_batches, times = time_calls(lambda i: next(gen), range(n_train_steps))
+    results['generator'] = (n_train_steps*batch_size, times)
+
+    # train, warm-up step (graph construction) not timed
+    model = unet_model(dim,0.0001,0,0,3,'he_normal',n_filters,depth)
+    model.train_on_batch(train_batches[0][0], train_batches[0][1])
+    _, times = time_calls(lambda b: model.train_on_batch(b[0], b[1]), train_batches)
+    results['train'] = (n_train_steps*batch_size, times)
+
+    # predict, per batch
+    model.predict(data[:batch_size], batch_size=batch_size)
+    pred, times = time_calls(lambda i: model.predict(data[i:i+batch_size], batch_size=batch_size), batches)
+    results['predict'] = (n_imgs, times)
+
+    # extract, per image. Predictions of random weights don't contain rings, so by default the ring targets are used
+    extract_craters = get_extractor(extractor)
+    tiles = np.concatenate(pred) if extract_input == 'pred' else target
+    _, times = time_calls(lambda t: extract_craters(t.copy()), tiles)
+    results['extract'] = (n_imgs, times)
+
+    stages = ['preprocess','generator','train','predict','extract']
+    print_results(results, stages)
+    return results
+
+################
+#Arguments, Run#
+########################################################################
+if __name__ == '__main__':
+    #args
+    n_imgs = 64             #number of synthetic tiles, multiple of batch_size
+    dim = 256               #tile width/height (pixels), same as the data
+    batch_size = 8
+    n_train_steps = 8       #number of training batches
+    n_filters = 8           #See unet model. Small, so the benchmark runs in a few minutes on CPU.
+    depth = 3               #See unet model. Number of pooling levels.
+    extractor = 'template'  #crater extraction backend, see utils/crater_extractors.py
+    extract_input = 'target'  #'target' = extract craters from the synthetic ring targets, 'pred' = from the model output
+    inv_color = 1
+    rescale = 1
+
+    benchmark_pipeline(n_imgs,dim,batch_size,n_train_steps,n_filters,depth,extractor,extract_input,inv_color,rescale)
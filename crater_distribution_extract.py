@@ -5,23 +5,19 @@
 # lolaout_train/dev/test.p should go in the 'dir' variable directory. 
 #####################################################
 
+# Heavy dependencies (keras, skimage/cv2, pandas) are only imported by the code paths that need them, so e.g.
+# ground_truth_only=1 runs don't load keras. See moon_cli.py.
 import numpy as np
 import cPickle
-import cv2
 import glob
 import os
-import pandas as pd
-from PIL import Image
-import matplotlib.pyplot as plt
-from keras.models import load_model
-
-from utils.rescale_invcolor import *
-from utils.template_match_target import *
 
 ################
 #Read/Load Data#
 ########################################################################
 def load_data(path, data_type):
+    import cv2
+    from PIL import Image
     X = []
     X_id = []
     y = []
@@ -42,11 +38,68 @@ def read_and_normalize_data(path, dim, data_type):
     print('%s shape:'%data_type, data.shape)
     return data, target, id_
 
+###########################################
+#Resumable extraction, streaming histogram#
+########################################################################
+# Radii are appended to a raw .part file chunk by chunk, and a checkpoint (.ckpt.npz) with the number of images done,
+# the number of radii written and the running log-binned histogram is saved after every chunk. On restart, the .part
+# file is truncated to the last checkpoint and extraction continues from there. Once finished the full distribution is
+# saved as .npy (as before) and the histogram as _hist.npz, so plotting doesn't need to load all radii.
+def log_bins(min_km=0.1, max_km=1000., nbins=100):
+    #log-spaced radius bins (km)
+    return np.logspace(np.log10(min_km), np.log10(max_km), nbins+1)
+
+def load_checkpoint(outbase, settings, bins):
+    #returns images done, radii written and histogram counts of a previous (interrupted) run, if settings match
+    try:
+        ckpt = np.load('%s.ckpt.npz'%outbase)
+        if str(ckpt['settings']) == settings and np.array_equal(ckpt['bins'], bins):
+            print "Resuming from checkpoint %s.ckpt.npz, %d images already done."%(outbase, int(ckpt['i_next']))
+            return int(ckpt['i_next']), int(ckpt['n_radii']), ckpt['counts']
+        print "Checkpoint %s.ckpt.npz was made with different settings, starting over."%outbase
+    except IOError:
+        pass
+    return 0, 0, np.zeros(len(bins)-1, dtype=int)
+
+def save_checkpoint(outbase, settings, bins, i_next, n_radii, counts):
+    #write to a temporary file first, so a crash during saving can't corrupt the checkpoint
+    with open('%s.ckpt.tmp'%outbase, 'wb') as f:
+        np.savez(f, settings=settings, bins=bins, i_next=i_next, n_radii=n_radii, counts=counts)
+    os.rename('%s.ckpt.tmp'%outbase, '%s.ckpt.npz'%outbase)
+
+def extract_dist_resumable(outbase, n, chunk_size, get_radii, settings, bins):
+    #get_radii(i0, i1) - returns the radii (km) of images i0 to i1, all radii are saved to outbase.npy
+    i_start, n_radii, counts = load_checkpoint(outbase, settings, bins)
+    if n_radii > 0 and not os.path.isfile('%s.part'%outbase):
+        print "Radii file %s.part of the checkpoint is missing, starting over."%outbase
+        i_start, n_radii, counts = 0, 0, np.zeros(len(bins)-1, dtype=int)
+    with open('%s.part'%outbase, 'ab') as f:
+        f.truncate(n_radii*8)       #discard radii written after the last checkpoint
+        f.seek(n_radii*8)
+        for i0 in range(i_start, n, chunk_size):
+            i1 = min(i0+chunk_size, n)
+            radii = np.asarray(get_radii(i0, i1), dtype='float64')
+            radii.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+            n_radii += len(radii)
+            counts += np.histogram(radii, bins)[0]
+            save_checkpoint(outbase, settings, bins, i1, n_radii, counts)
+            print "%d/%d images done, %d craters."%(i1, n, n_radii)
+
+    dist = np.fromfile('%s.part'%outbase, dtype='float64', count=n_radii)
+    np.save('%s.npy'%outbase, dist)
+    np.savez('%s_hist.npz'%outbase, bins=bins, counts=counts)
+    os.remove('%s.ckpt.npz'%outbase)     #checkpoint first, a checkpoint without its .part file would resume with no radii
+    os.remove('%s.part'%outbase)
+    return dist, counts
+
 ##############
 #Main Routine#
 ########################################################################
-def get_crater_dist(dir,type,n_imgs,modelpath,inv_color,rescale,ground_truth_only):
-    pred_crater_dist, GT_crater_dist = [], []
+def get_crater_dist(dir,type,n_imgs,modelpath,inv_color,rescale,ground_truth_only,extractor='template',chunk_size=500,cache_dir='models/pred_cache'):
+    pred_crater_dist = []
+    bins = log_bins()               #histogram bins (km) of the streaming size-frequency distribution
     
     # properties of the dataset, shouldn't change (unless you use a different dataset)
     master_img_height_pix = 20000.  #number of pixels for height
@@ -58,8 +111,8 @@ def get_crater_dist(dir,type,n_imgs,modelpath,inv_color,rescale,ground_truth_onl
     # get data
     path = {'train':'%s/Train_rings/'%dir, 'dev':'%s/Dev_rings/'%dir, 'test':'%s/Test_rings/'%dir}
     try:
-        data=np.load('%s%s_data.npy'%(path[type],type))
-        target=np.load('%s%s_target.npy'%(path[type],type))
+        data=np.load('%s%s_data.npy'%(path[type],type), mmap_mode='r')    #only the chunk being predicted is read
+        target=np.load('%s%s_target.npy'%(path[type],type), mmap_mode='r')
         id=np.load('%s%s_id.npy'%(path[type],type))
         print "Successfully loaded %s files locally."%path[type]
     except:
@@ -72,44 +125,60 @@ def get_crater_dist(dir,type,n_imgs,modelpath,inv_color,rescale,ground_truth_onl
     data, target, id = data[:n_imgs], target[:n_imgs], id[:n_imgs]
 
     if ground_truth_only == 0:
-        if inv_color==1 or rescale==1:
-            print "inv_color=%d, rescale=%d, processing data"%(inv_color, rescale)
-            data = rescale_and_invcolor(data, inv_color, rescale)
+        print "Extracting crater radius distribution of %d %s files using the '%s' extractor."%(n_imgs,type,extractor)
+        from utils.crater_extractors import get_extractor
+        from utils.prediction_cache import cached_predict, file_hash
+        extract_craters = get_extractor(extractor)
+        model = []                  #only loaded if there are images left to predict that aren't in the prediction cache
         
-        # generate model predictions
-        model = load_model(modelpath)
-        pred = model.predict(data.astype('float32'))
-
-        # extract crater distribution, remove duplicates live
-        print "Extracting crater radius distribution of %d %s files."%(n_imgs,type)
-        for i in range(len(pred)):
-            coords = template_match_target(pred[i])
-            img_pix_height = P[id[i]]['box'][2] - P[id[i]]['box'][0]
-            pix_to_km = (master_img_height_lat/master_img_height_pix)*(np.pi/180)*(img_pix_height/dim)*r_moon
-            if len(coords) >= 1:
-                _,_,radii = zip(*coords*pix_to_km)
-                pred_crater_dist += list(radii)
-
-        pred_crater_dist = np.asarray(pred_crater_dist)
-        np.save('%s%s_predcraterdist_n%d.npy'%(path[type],type,n_imgs),pred_crater_dist)
+        def get_model():
+            if model == []:
+                from keras.models import load_model
+                model.append(load_model(modelpath))
+            return model[0]
+        
+        def get_pred_radii(i0, i1):
+            # generate model predictions, or load them from the cache (utils/prediction_cache.py)
+            pred = cached_predict(modelpath, data[i0:i1], inv_color, rescale, get_model, cache_dir)
+            
+            # extract crater distribution, remove duplicates live
+            radii_chunk = []
+            for i in range(len(pred)):
+                coords = extract_craters(pred[i])
+                img_pix_height = P[id[i0+i]]['box'][2] - P[id[i0+i]]['box'][0]
+                pix_to_km = (master_img_height_lat/master_img_height_pix)*(np.pi/180)*(img_pix_height/dim)*r_moon
+                if len(coords) >= 1:
+                    _,_,radii = zip(*coords*pix_to_km)
+                    radii_chunk += list(radii)
+            return radii_chunk
+        
+        #the model hash makes a retrained/overwritten model start over instead of resuming with the old model's radii
+        settings = 'model=%s (%s), inv_color=%d, rescale=%d, extractor=%s'%(modelpath,file_hash(modelpath),inv_color,rescale,extractor)
+        outbase = '%s%s_predcraterdist_n%d'%(path[type],type,n_imgs)
+        pred_crater_dist, _ = extract_dist_resumable(outbase, len(data), chunk_size, get_pred_radii, settings, bins)
 
     # Generate csv dist
     # hyperparameters
     minrad, maxrad = 3, 75  #min/max radius (in pixels) required to include crater in target
     cutrad = 1              #0-1 range, if x+cutrad*r > dim, remove, higher cutrad = larger % of circle required
     print "Getting ground truth crater distribution."
-    for id_ in id:
-        csv = pd.read_csv('%slola_%s.csv'%(path[type],str(id_).zfill(5)))
-        csv = csv[(csv['Diameter (pix)'] < 2*maxrad) & (csv['Diameter (pix)'] > 2*minrad)]
-        csv = csv[(csv['x']+cutrad*csv['Diameter (pix)']/2 <= dim)]
-        csv = csv[(csv['y']+cutrad*csv['Diameter (pix)']/2 <= dim)]
-        csv = csv[(csv['x']-cutrad*csv['Diameter (pix)']/2 > 0)]
-        csv = csv[(csv['y']-cutrad*csv['Diameter (pix)']/2 > 0)]
-        GT_radius = csv['Diameter (km)'].values/2
-        GT_crater_dist += list(GT_radius)
+    import pandas as pd
+    def get_GT_radii(i0, i1):
+        radii_chunk = []
+        for id_ in id[i0:i1]:
+            csv = pd.read_csv('%slola_%s.csv'%(path[type],str(id_).zfill(5)))
+            csv = csv[(csv['Diameter (pix)'] < 2*maxrad) & (csv['Diameter (pix)'] > 2*minrad)]
+            csv = csv[(csv['x']+cutrad*csv['Diameter (pix)']/2 <= dim)]
+            csv = csv[(csv['y']+cutrad*csv['Diameter (pix)']/2 <= dim)]
+            csv = csv[(csv['x']-cutrad*csv['Diameter (pix)']/2 > 0)]
+            csv = csv[(csv['y']-cutrad*csv['Diameter (pix)']/2 > 0)]
+            GT_radius = csv['Diameter (km)'].values/2
+            radii_chunk += list(GT_radius)
+        return radii_chunk
 
-    GT_crater_dist = np.asarray(GT_crater_dist)
-    np.save('%s%s_GTcraterdist_n%d_cutrad1.npy'%(path[type],type,n_imgs),GT_crater_dist)
+    settings = 'minrad=%d, maxrad=%d, cutrad=%f'%(minrad,maxrad,cutrad)
+    outbase = '%s%s_GTcraterdist_n%d_cutrad1'%(path[type],type,n_imgs)
+    GT_crater_dist, _ = extract_dist_resumable(outbase, len(id), chunk_size, get_GT_radii, settings, bins)
     return pred_crater_dist, GT_crater_dist
 
 ################
@@ -125,6 +194,9 @@ if __name__ == '__main__':
     modelpath = 'models/unet_s256_rings_nFL96.h5'
     inv_color = 1           #**must be same setting as what model was trained on**
     rescale = 1             #**must be same setting as what model was trained on**
+    extractor = 'template'  #crater extraction backend: template, template_pyramid, template_roi, hough (see utils/crater_extractors.py)
+    chunk_size = 500        #images per chunk, progress is checkpointed after every chunk. Rerun the script to resume.
+    cache_dir = 'models/pred_cache' #cache of predictions by model/input/settings (utils/prediction_cache.py), None = no cache
 
-    pred_crater_dist, GT_crater_dist = get_crater_dist(dir,type,n_imgs,modelpath,inv_color,rescale,ground_truth_only)
+    pred_crater_dist, GT_crater_dist = get_crater_dist(dir,type,n_imgs,modelpath,inv_color,rescale,ground_truth_only,extractor,chunk_size,cache_dir)
     print "Script completed successfully"
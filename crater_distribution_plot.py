@@ -1,18 +1,36 @@
 #plot the results on local machine
 
+import os
 import numpy as np
-import matplotlib.pyplot as plt
 
-pred = np.load('datasets/rings/Test_rings/test_predcraterdist_n30016.npy')
-truth = np.load('datasets/rings/Test_rings/test_GTcraterdist_n30016_cutrad1.npy')
+def plot_crater_dist(pred_base, truth_base, outfile, norm=False, nbins=100, show=True):
+    import matplotlib.pyplot as plt     #imported here so that importing this module stays fast (see moon_cli.py)
 
-norm = False
-nbins = 100
+    #use the streaming histograms saved by crater_distribution_extract.py if available, no need to load all radii
+    if os.path.isfile('%s_hist.npz'%pred_base) and os.path.isfile('%s_hist.npz'%truth_base):
+        pred, truth = np.load('%s_hist.npz'%pred_base), np.load('%s_hist.npz'%truth_base)
+        bins = pred['bins']
+        plt.hist(bins[:-1], bins, weights=pred['counts'], normed=norm, label='pred')
+        plt.hist(bins[:-1], bins, weights=truth['counts'], normed=norm, alpha=0.5, label='ground truth')
+        plt.xscale('log')
+    else:
+        pred = np.load('%s.npy'%pred_base)
+        truth = np.load('%s.npy'%truth_base)
+        plt.hist(pred, nbins, range=[min(truth),max(truth)], normed=norm, label='pred')
+        #plt.hist(pred, nbins, normed=norm, label='pred')
+        plt.hist(truth, nbins, normed=norm, alpha=0.5, label='ground truth')
+    plt.legend()
+    plt.yscale('log')
+    plt.savefig(outfile)
+    if show:
+        plt.show()
 
-plt.hist(pred, nbins, range=[min(truth),max(truth)], normed=norm, label='pred')
-#plt.hist(pred, nbins, normed=norm, label='pred')
-plt.hist(truth, nbins, normed=norm, alpha=0.5, label='ground truth')
-plt.legend()
-plt.yscale('log')
-plt.savefig('output_dir/images/cutrad1_bin100.png')
-plt.show()
+if __name__ == '__main__':
+    pred_base = 'datasets/rings/Test_rings/test_predcraterdist_n30016'
+    truth_base = 'datasets/rings/Test_rings/test_GTcraterdist_n30016_cutrad1'
+    outfile = 'output_dir/images/cutrad1_bin100.png'
+
+    norm = False
+    nbins = 100
+
+    plot_crater_dist(pred_base, truth_base, outfile, norm, nbins)
@@ -0,0 +1,140 @@
+##########
+#MOON_CLI#
+#####################################################
+# Single command line entry point for training, predicting, extracting crater distributions and analyzing them, e.g.:
+#   python moon_cli.py train --dir dataset --n-filters 64 64 --init he_normal he_uniform
+#   python moon_cli.py predict --models models/unet_s256_rings.h5 --ensemble 1
+#   python moon_cli.py extract --dir datasets --type test --ground-truth-only 1
+#   python moon_cli.py analyze --pred datasets/Test_rings/test_predcraterdist_n30016 --truth datasets/Test_rings/test_GTcraterdist_n30016_cutrad1
+# Heavy dependencies (keras/tensorflow, skimage, cv2, pandas, matplotlib) are only imported inside the subcommand that
+# needs them, so e.g. ground truth extraction and analysis don't pay for loading keras.
+# --timing reports the startup time (launch -> start of the actual work) and which heavy modules were loaded by then.
+# --check-startup does the same without running the job, and exits with 1 if STARTUP_BUDGET is exceeded.
+#####################################################
+import time
+t_start = time.time()
+
+import argparse
+import sys
+
+STARTUP_BUDGET = 0.5    #seconds, launch -> start of work, for subcommands that don't need keras (extract -g, analyze)
+HEAVY_MODULES = ['keras', 'tensorflow', 'skimage', 'cv2', 'pandas', 'matplotlib', 'scipy']
+
+def report_startup(args):
+    #called by each subcommand right before starting its work
+    if not (args.timing or args.check_startup):
+        return
+    elapsed = time.time() - t_start
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    print "startup: %.3fs (budget %.2fs), heavy modules loaded: %s"%(elapsed, STARTUP_BUDGET, ', '.join(loaded) or 'none')
+    if args.check_startup:
+        sys.exit(0 if elapsed <= STARTUP_BUDGET else 1)
+
+#############
+#Subcommands#
+########################################################################
+def train(args):
+    import run_moon_convnet_model as rmcm    #keras
+    report_startup(args)
+    rmcm.run_models(args.dir, args.lr, args.batch_size, args.epochs, args.n_train, args.inv_color, args.rescale,
+                    args.save_models, args.filter_length, args.n_filters, args.lmbda, args.init, args.depth,
+                    args.width_mult, args.separable, args.max_mem, args.extractor, args.shuffle, args.block_size,
+                    args.buffer_blocks)
+
+def predict(args):
+    import rings_analyze_remote as rar      #keras is imported once predicting starts
+    report_startup(args)
+    if args.ensemble == 1:
+        rar.predict_targets_ensemble(args.dir, args.inv_color, args.rescale, args.n_pred_samples, args.offset,
+                                     args.models, args.chunk_size, args.average)
+    else:
+        rar.predict_targets(args.dir, args.inv_color, args.rescale, args.n_pred_samples, args.offset, args.models,
+                            args.cache_dir or None)
+
+def extract(args):
+    import crater_distribution_extract as cde   #keras/skimage only if predicting, pandas once reading csvs
+    report_startup(args)
+    cde.get_crater_dist(args.dir, args.type, args.n_imgs, args.model, args.inv_color, args.rescale,
+                        args.ground_truth_only, args.extractor, args.chunk_size, args.cache_dir or None)
+
+def analyze(args):
+    import crater_distribution_plot as cdp      #matplotlib is imported once plotting starts
+    report_startup(args)
+    cdp.plot_crater_dist(args.pred, args.truth, args.out, args.norm, args.nbins, args.show)
+
+################
+#Arguments, Run#
+########################################################################
+def get_parser():
+    parser = argparse.ArgumentParser(description='Lunar crater counting using convolutional networks.')
+    parser.add_argument('--timing', action='store_true', help='report startup time and loaded heavy modules')
+    parser.add_argument('--check-startup', action='store_true', help='only check the startup time against STARTUP_BUDGET')
+    sub = parser.add_subparsers(dest='command')
+
+    # shared options
+    def add_preprocessing(p):
+        p.add_argument('--inv-color', type=int, default=1, help='use inverse color (must match the model)')
+        p.add_argument('--rescale', type=int, default=1, help='rescale images to increase contrast (must match the model)')
+
+    def add_cache(p):
+        p.add_argument('--cache-dir', default='models/pred_cache', help='prediction cache, see utils/prediction_cache.py. "" = no cache')
+
+    p = sub.add_parser('train', help='train (a sweep of) models, see run_moon_convnet_model.py')
+    p.add_argument('--dir', default='dataset', help='location of the Train/Dev/Test_rings and Dev_rings_for_loss folders')
+    p.add_argument('--lr', type=float, default=0.0001, help='learning rate')
+    p.add_argument('--batch-size', type=int, default=32)
+    p.add_argument('--epochs', type=int, default=6)
+    p.add_argument('--n-train', type=int, default=6016, help='number of training samples, multiple of the batch size')
+    add_preprocessing(p)
+    p.add_argument('--save-models', type=int, default=1)
+    p.add_argument('--filter-length', type=int, nargs='+', default=[3,3])
+    p.add_argument('--n-filters', type=int, nargs='+', default=[64,64])
+    p.add_argument('--lmbda', type=float, nargs='+', default=[0,0])
+    p.add_argument('--init', nargs='+', default=['he_normal','he_uniform'])
+    p.add_argument('--depth', type=int, nargs='+', default=[3,3])
+    p.add_argument('--width-mult', type=float, nargs='+', default=[1,1])
+    p.add_argument('--separable', type=int, nargs='+', default=[0,0])
+    p.add_argument('--max-mem', type=float, default=0, help='GB, skip runs with a larger estimated memory. 0 = no check')
+    p.add_argument('--extractor', default='template', help='crater extraction backend for the custom loss')
+    p.add_argument('--shuffle', type=int, default=1, help='block-shuffle training batches every epoch')
+    p.add_argument('--block-size', type=int, default=32, help='shuffle only - consecutive images shuffled as a block')
+    p.add_argument('--buffer-blocks', type=int, default=16, help='shuffle only - blocks shuffled together in memory')
+    p.set_defaults(func=train)
+
+    p = sub.add_parser('predict', help='generate model predictions on test images, see rings_analyze_remote.py')
+    p.add_argument('--dir', default='dataset', help='location of the Test_rings folder')
+    add_preprocessing(p)
+    p.add_argument('--n-pred-samples', type=int, default=20)
+    p.add_argument('--offset', type=int, default=0)
+    p.add_argument('--models', nargs='+', required=True)
+    p.add_argument('--ensemble', type=int, default=0, help='1 = one memory-mapped file with a channel per model')
+    p.add_argument('--chunk-size', type=int, default=32)
+    p.add_argument('--average', type=int, default=1)
+    add_cache(p)
+    p.set_defaults(func=predict)
+
+    p = sub.add_parser('extract', help='extract crater distributions, see crater_distribution_extract.py')
+    p.add_argument('--dir', default='datasets', help='location of the Train/Dev/Test_rings folders and lolaout_*.p')
+    p.add_argument('--type', default='test', choices=['train','dev','test'])
+    p.add_argument('--n-imgs', type=int, default=30016)
+    p.add_argument('--model', default='models/unet_s256_rings_nFL96.h5')
+    add_preprocessing(p)
+    p.add_argument('-g', '--ground-truth-only', type=int, default=0, help='1 = only get the ground truth distribution')
+    p.add_argument('--extractor', default='template', help='template, template_pyramid, template_roi, hough')
+    p.add_argument('--chunk-size', type=int, default=500, help='images per checkpointed chunk')
+    add_cache(p)
+    p.set_defaults(func=extract)
+
+    p = sub.add_parser('analyze', help='plot predicted vs. ground truth crater distributions, see crater_distribution_plot.py')
+    p.add_argument('--pred', required=True, help='predicted distribution, path without .npy/_hist.npz')
+    p.add_argument('--truth', required=True, help='ground truth distribution, path without .npy/_hist.npz')
+    p.add_argument('--out', default='output_dir/images/cutrad1_bin100.png')
+    p.add_argument('--nbins', type=int, default=100)
+    p.add_argument('--norm', type=int, default=0)
+    p.add_argument('--show', type=int, default=1)
+    p.set_defaults(func=analyze)
+    return parser
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    args.func(args)
@@ -1,14 +1,14 @@
 import glob
 import numpy as np
 
-from keras.models import load_model
-from keras import backend as K
 from utils.rescale_invcolor import rescale_and_invcolor
+from utils.prediction_cache import cached_predict
 
 ##############
 #Main Routine#
 ########################################################################
-def predict_targets(dir,inv_color,rescale,n_pred_samples,offset,models):
+def predict_targets(dir,inv_color,rescale,n_pred_samples,offset,models,cache_dir='models/pred_cache'):
+    #predictions are cached by model/input/settings in cache_dir (see utils/prediction_cache.py), None = no cache
     #static arguments
     dim = 256               #image dimensions, assuming square images. Should not change
     
@@ -27,22 +27,68 @@ def predict_targets(dir,inv_color,rescale,n_pred_samples,offset,models):
     else:
         test_data = np.load('%s/Test_rings/test_data.npy'%dir)[:n_pred_samples]
         test_target = np.load('%s/Test_rings/test_target.npy'%dir)[:n_pred_samples]
-    test_data = rescale_and_invcolor(test_data, inv_color, rescale)
+    test_data = test_data[offset:(n_pred_samples+offset)]
+    test_target = test_target[offset:(n_pred_samples+offset)]
+
+    proc_data = rescale_and_invcolor(test_data.astype('float32'), inv_color, rescale)   #raw test_data is the cache key
 
     print "Generating predictions."
     for m in models:
-        model = load_model('%s'%m)
-        target_pred = model.predict(test_data[offset:(n_pred_samples+offset)].astype('float32'))
+        target_pred = cached_predict(m, test_data, inv_color, rescale, cache_dir=cache_dir)
         
         #dimensions go data, ground_truth targets, predicted targets
-        result = np.concatenate((test_data[offset:(n_pred_samples+offset)],
-                                 test_target[offset:(n_pred_samples+offset)].reshape(n_pred_samples,dim,dim,1),
+        result = np.concatenate((proc_data,
+                                 test_target.reshape(n_pred_samples,dim,dim,1),
                                  target_pred.reshape(n_pred_samples,dim,dim,1)),axis=3)
                                  
         name = m.split('.h5')[0]
         np.save('%s_pred.npy'%name,result)
         print "Successfully generated predictions at %s_pred.npy for model %s."%(name,m)
 
+############################################
+#Ensemble - shared input, one channel/model#
+########################################################################
+#Data and ground truth are written once, followed by one prediction channel per model (and optionally their mean),
+#so the output layout stays compatible with the notebook (channel 2 = first model).
+#Predictions are streamed in chunks into a memory-mapped .npy instead of building a new array per model.
+def predict_targets_ensemble(dir,inv_color,rescale,n_pred_samples,offset,models,chunk_size=32,average=1,outname='models/ensemble_pred.npy'):
+    from keras.models import load_model
+    from keras import backend as K
+    #static arguments
+    dim = 256               #image dimensions, assuming square images. Should not change
+    
+    #load data once, memory-mapped so only the slice we predict on is read
+    test_data = np.load('%s/Test_rings/test_data.npy'%dir, mmap_mode='r')[offset:(n_pred_samples+offset)]
+    test_target = np.load('%s/Test_rings/test_target.npy'%dir, mmap_mode='r')[offset:(n_pred_samples+offset)]
+    n_pred_samples = len(test_data)
+    test_data = rescale_and_invcolor(np.array(test_data, dtype='float32'), inv_color, rescale)
+
+    #output channels: data, ground truth, one per model, (mean of models)
+    n_models = len(models)
+    n_channels = 2 + n_models + average
+    result = np.lib.format.open_memmap(outname, mode='w+', dtype='float32', shape=(n_pred_samples,dim,dim,n_channels))
+    result[:,:,:,0] = test_data[:,:,:,0]
+    result[:,:,:,1] = test_target
+    
+    print "Generating ensemble predictions for %d models."%n_models
+    for j, m in enumerate(models):
+        model = load_model('%s'%m)
+        for i in range(0, n_pred_samples, chunk_size):
+            result[i:i+chunk_size,:,:,2+j] = model.predict(test_data[i:i+chunk_size], batch_size=chunk_size).reshape(-1,dim,dim)
+        result.flush()
+        del model
+        K.clear_session()
+        print "Added predictions of model %s to channel %d."%(m,2+j)
+    
+    if average == 1:
+        for i in range(0, n_pred_samples, chunk_size):
+            result[i:i+chunk_size,:,:,-1] = np.mean(result[i:i+chunk_size,:,:,2:2+n_models], axis=3)
+        print "Added mean ensemble prediction to channel %d."%(n_channels-1)
+    
+    result.flush()
+    print "Successfully generated ensemble predictions at %s."%outname
+    return result
+
 ################
 #Arguments, Run#
 ########################################################################
@@ -54,7 +100,14 @@ if __name__ == '__main__':
     n_pred_samples = 20     #number of test images to predict on
     offset = 0              #index offset to start predictions at in test array
     models = ['models/run_moon_convnet_model_FL3_he_normal.h5','models/run_moon_convnet_model_FL3_he_uniform.h5']
+    ensemble = 0            #1 = write all models into a single memory-mapped file (one channel per model) instead of one file per model
+    chunk_size = 32         #ensemble only - number of images predicted at once
+    average = 1             #ensemble only - also store the mean prediction over models as the last channel
+    cache_dir = 'models/pred_cache' #cache of predictions by model/input/settings (utils/prediction_cache.py), None = no cache
     
-    predict_targets(dir,inv_color,rescale,n_pred_samples,offset,models)
+    if ensemble == 1:
+        predict_targets_ensemble(dir,inv_color,rescale,n_pred_samples,offset,models,chunk_size,average)
+    else:
+        predict_targets(dir,inv_color,rescale,n_pred_samples,offset,models,cache_dir)
     
 
@@ -32,16 +32,24 @@ K.set_image_dim_ordering('tf')
 #custom functions
 from utils.rescale_invcolor import *
 from utils.template_match_target import *
+from utils.block_shuffle import block_shuffled_batches
+from utils.unet_model import unet_model
+from utils.unet_estimate import estimate_unet, print_unet_estimate
+from utils.memory_tracker import record_memory, clear_keras_session, memory_report
 
 ########################
 #custom image generator#
 ########################################################################
 #Following https://github.com/fchollet/keras/issues/2708
-def custom_image_generator(data, target, batch_size=32):
+#shuffle=1 - new batch order every epoch, see utils/block_shuffle.py. Otherwise batches are taken in the stored order.
+def custom_image_generator(data, target, batch_size=32, shuffle=0, block_size=32, buffer_blocks=16):
     L, W = data[0].shape[0], data[0].shape[1]
     while True:
-        for i in range(0, len(data), batch_size):
-            d, t = data[i:i+batch_size].copy(), target[i:i+batch_size].copy() #most efficient for memory?
+        if shuffle == 1:
+            batches = block_shuffled_batches(data, target, batch_size, block_size, buffer_blocks)
+        else:
+            batches = ((data[i:i+batch_size].copy(), target[i:i+batch_size].copy()) for i in range(0, len(data), batch_size)) #most efficient for memory?
+        for d, t in batches:
             
             #horizontal/vertical flips
             for j in np.where(np.random.randint(0,2,batch_size)==1)[0]:
@@ -60,69 +68,18 @@ def custom_image_generator(data, target, batch_size=32):
                 d[j], t[j] = np.rot90(d[j],r[j]), np.rot90(t[j],r[j])
             yield (d, t)
 
-##########################
-#unet model (keras 1.2.2)#
-########################################################################
-#Following https://arxiv.org/pdf/1505.04597.pdf
-#and this for merging specifics: https://gist.github.com/Neltherion/f070913fd6284c4a0b60abb86a0cd642
-def unet_model(dim,learn_rate,lmbda,FL,init,n_filters):
-    print('Making UNET model...')
-    img_input = Input(batch_shape=(None, dim, dim, 1))
-
-    a1 = Convolution2D(n_filters, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(img_input)
-    a1 = Convolution2D(n_filters, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(a1)
-    a1P = MaxPooling2D((2, 2), strides=(2, 2))(a1)
-
-    a2 = Convolution2D(n_filters*2, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(a1P)
-    a2 = Convolution2D(n_filters*2, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(a2)
-    a2P = MaxPooling2D((2, 2), strides=(2, 2))(a2)
-
-    a3 = Convolution2D(n_filters*4, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(a2P)
-    a3 = Convolution2D(n_filters*4, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(a3)
-    a3P = MaxPooling2D((2, 2), strides=(2, 2),)(a3)
-
-    u = Convolution2D(n_filters*4, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(a3P)
-    u = Convolution2D(n_filters*4, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(u)
-
-    u = UpSampling2D((2,2))(u)
-    u = merge((a3, u), mode='concat', concat_axis=3)
-    u = Convolution2D(n_filters*4, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(u)
-    u = Convolution2D(n_filters*4, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(u)
-
-    u = UpSampling2D((2,2))(u)
-    u = merge((a2, u), mode='concat', concat_axis=3)
-    u = Convolution2D(n_filters*2, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(u)
-    u = Convolution2D(n_filters*2, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(u)
-
-    u = UpSampling2D((2,2))(u)
-    u = merge((a1, u), mode='concat', concat_axis=3)
-    u = Convolution2D(n_filters, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(u)
-    u = Convolution2D(n_filters, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(u)
-
-    #final output
-    final_activation = 'sigmoid'       #sigmoid, relu
-    u = Convolution2D(1, 1, 1, activation=final_activation, init=init, W_regularizer=l2(lmbda), name='output', border_mode='same')(u)
-    u = Reshape((dim, dim))(u)
-    model = Model(input=img_input, output=u)
-    
-    #optimizer/compile
-    optimizer = Adam(lr=learn_rate, beta_1=0.9, beta_2=0.999, epsilon=1e-08, decay=0.0)
-    model.compile(loss='binary_crossentropy', optimizer=optimizer)  #binary cross-entropy severely penalizes opposite predictions.
-    print model.summary()
-
-    return model
-
 ##################
 #Train/Test Model#
 ########################################################################
 #Need to create this function so that memory is released every iteration (when function exits).
 #Otherwise the memory used accumulates and eventually the program crashes.
-def train_and_test_model(X_train,Y_train,X_valid,Y_valid,X_test,Y_test,loss_data,loss_csvs,dim,learn_rate,nb_epoch,batch_size,save_models,lmbda,FL,init,n_filters):
-    model = unet_model(dim,learn_rate,lmbda,FL,init,n_filters)
+#The backend session is also cleared between runs, and memory is recorded in mem_log every epoch (utils/memory_tracker.py).
+def train_and_test_model(X_train,Y_train,X_valid,Y_valid,X_test,Y_test,loss_data,loss_csvs,dim,learn_rate,nb_epoch,batch_size,save_models,lmbda,FL,init,n_filters,extractor='template',shuffle=0,depth=3,width_mult=1.,separable=0,mem_log=None,run=0,block_size=32,buffer_blocks=16):
+    model = unet_model(dim,learn_rate,lmbda,0,FL,init,n_filters,depth,width_mult,separable)
     
     n_samples = len(X_train)
     for nb in range(nb_epoch):
-        model.fit_generator(custom_image_generator(X_train,Y_train,batch_size=batch_size),
+        model.fit_generator(custom_image_generator(X_train,Y_train,batch_size=batch_size,shuffle=shuffle,block_size=block_size,buffer_blocks=buffer_blocks),
                         samples_per_epoch=n_samples,nb_epoch=1,verbose=1,
                         #validation_data=(X_valid, Y_valid), #no generator for validation data
                         validation_data=custom_image_generator(X_valid,Y_valid,batch_size=batch_size),
@@ -135,7 +92,7 @@ def train_and_test_model(X_train,Y_train,X_valid,Y_valid,X_test,Y_test,loss_data
         match_csv_arr, templ_csv_arr, templ_new_arr = [], [], []
         loss_target = model.predict(loss_data.astype('float32'))
         for i in range(len(loss_data)):
-            N_match, N_csv, N_templ, csv_duplicate_flag = template_match_target_to_csv(loss_target[i], loss_csvs[i])
+            N_match, N_csv, N_templ, csv_duplicate_flag = template_match_target_to_csv(loss_target[i], loss_csvs[i], extractor=extractor)
             match_csv, templ_csv, templ_new = 0, 0, 0
             if N_csv > 0:
                 match_csv = float(N_match)/float(N_csv)             #recall
@@ -147,16 +104,20 @@ def train_and_test_model(X_train,Y_train,X_valid,Y_valid,X_test,Y_test,loss_data
         print "mean and std of N_template/N_csv = %f, %f"%(np.mean(templ_csv_arr), np.std(templ_csv_arr))
         print "mean and std of (N_template - N_match)/N_template (fraction of craters that are new) = %f, %f"%(np.mean(templ_new_arr), np.std(templ_new_arr))
         print ""
+        del loss_target
+        record_memory('run %d epoch %d/%d'%(run,nb+1,nb_epoch), mem_log)
     
     if save_models == 1:
         model.save('models/run_moon_convnet_model_FL%d_%s.h5'%(FL,init))
 
-    return model.evaluate(X_test.astype('float32'), Y_test.astype('float32'))
+    score = model.evaluate(X_test.astype('float32'), Y_test.astype('float32'))
+    del model
+    return score
 
 ##############
 #Main Routine#
 ########################################################################
-def run_models(dir,learn_rate,batch_size,nb_epoch,n_train_samples,inv_color,rescale,save_models,filter_length,n_filters,lmbda,init):
+def run_models(dir,learn_rate,batch_size,nb_epoch,n_train_samples,inv_color,rescale,save_models,filter_length,n_filters,lmbda,init,depth,width_mult,separable,max_mem,extractor='template',shuffle=0,block_size=32,buffer_blocks=16):
     #Static arguments
     dim = 256              #image width/height, assuming square images. Shouldn't change
     
@@ -183,19 +144,32 @@ def run_models(dir,learn_rate,batch_size,nb_epoch,n_train_samples,inv_color,resc
         loss_data = rescale_and_invcolor(loss_data, inv_color, rescale)
 
     #Iterate
-    N_runs = np.min((len(filter_length),len(n_filters),len(lmbda),len(init)))
+    mem_log = []
+    record_memory('start', mem_log)
+    N_runs = np.min((len(filter_length),len(n_filters),len(lmbda),len(init),len(depth),len(width_mult),len(separable)))
     for i in range(N_runs):
         I = init[i]
         NF = n_filters[i]
         FL = filter_length[i]
         L = lmbda[i]
-        score = train_and_test_model(train_data,train_target,valid_data,valid_target,test_data,test_target,loss_data,loss_csvs,dim,learn_rate,nb_epoch,batch_size,save_models,L,FL,I,NF)
+        D, WM, S = depth[i], width_mult[i], separable[i]
+        
+        #check the model fits in memory before building it
+        est = estimate_unet(dim,FL,NF,D,WM,S,0,batch_size)
+        print_unet_estimate(est)
+        if max_mem > 0 and (est['activation_bytes'] + est['param_bytes']) > max_mem*1e9:
+            print "Skipping run %d (n_filters=%d, depth=%d, width_mult=%.2f, separable=%d), estimated memory > max_mem=%.1fGB"%(i,NF,D,WM,S,max_mem)
+            continue
+        score = train_and_test_model(train_data,train_target,valid_data,valid_target,test_data,test_target,loss_data,loss_csvs,dim,learn_rate,nb_epoch,batch_size,save_models,L,FL,I,NF,extractor,shuffle,D,WM,S,mem_log,i,block_size,buffer_blocks)
+        clear_keras_session()
+        record_memory('end of run %d'%i, mem_log)
         print '###################################'
         print '##########END_OF_RUN_INFO##########'
         print('\nTest Score is %f \n'%score)
-        print 'learning_rate=%e, batch_size=%d, filter_length=%e, n_epoch=%d, n_train_samples=%d, img_dimensions=%d, inv_color=%d, rescale=%d, init=%s, n_filters=%d'%(learn_rate,batch_size,FL,nb_epoch,n_train_samples,dim,inv_color,rescale,I,NF)
+        print 'learning_rate=%e, batch_size=%d, filter_length=%e, n_epoch=%d, n_train_samples=%d, img_dimensions=%d, inv_color=%d, rescale=%d, init=%s, n_filters=%d, depth=%d, width_mult=%f, separable=%d'%(learn_rate,batch_size,FL,nb_epoch,n_train_samples,dim,inv_color,rescale,I,NF,D,WM,S)
         print '###################################'
         print '###################################'
+    memory_report(mem_log)
 
 ################
 #Arguments, Run#
@@ -212,13 +186,21 @@ if __name__ == '__main__':
     inv_color = 1           #use inverse color
     rescale = 1             #rescale images to increase contrast (still 0-1 normalized)
     save_models = 1         #save models
+    extractor = 'template'  #crater extraction backend used for the custom loss, see utils/crater_extractors.py
+    shuffle = 1             #shuffle training batches every epoch (block-shuffled, see utils/block_shuffle.py)
+    block_size = 32         #shuffle only - number of consecutive images shuffled as a block
+    buffer_blocks = 16      #shuffle only - number of blocks shuffled together in memory (memory ~ block_size*buffer_blocks images)
+    max_mem = 0             #GB, skip runs whose estimated training memory (utils/unet_estimate.py) is larger. 0 = no check
     
     ########## Parameters to Iterate Over ##########
     filter_length = [3,3]   #See unet model. Filter length used.
     n_filters = [64,64]     #See unet model. Arranging this so that total number of model parameters <~ 10M, otherwise OOM problems
+    depth = [3,3]           #See unet model. Number of pooling levels.
+    width_mult = [1,1]      #See unet model. Multiplies n_filters.
+    separable = [0,0]       #See unet model. 1 = depthwise separable convolutions.
     lmbda = [0,0]           #See unet model. L2 Weight regularization strength (lambda).
     init = ['he_normal', 'he_uniform']  #See unet model. Initialization of weights.
     ########## Parameters to Iterate Over ##########
     
     #run models
-    run_models(dir,lr,bs,epochs,n_train,inv_color,rescale,save_models,filter_length,n_filters,lmbda,init)
+    run_models(dir,lr,bs,epochs,n_train,inv_color,rescale,save_models,filter_length,n_filters,lmbda,init,depth,width_mult,separable,max_mem,extractor,shuffle,block_size,buffer_blocks)
@@ -0,0 +1,28 @@
+##############################
+#block-shuffled batch sampler#
+########################################################################
+
+import numpy as np
+
+def block_shuffled_batches(data, target, batch_size, block_size=32, buffer_blocks=16):
+    #One epoch of (data, target) batches in random order, without random I/O on (memory-mapped) arrays:
+    #1) the order of contiguous blocks of block_size images is shuffled
+    #2) buffer_blocks blocks at a time are read (in file order, so reads stay close to sequential) into a buffer,
+    #   which is shuffled in memory and split into batches. Leftover images are carried over to the next buffer.
+    #Memory used ~ block_size*buffer_blocks images, e.g. 32*16 = 512 256x256 float32 images+targets = 256MB.
+    N = len(data)
+    starts = np.arange(0, N, block_size)
+    np.random.shuffle(starts)
+    d_left, t_left = data[:0].copy(), target[:0].copy()
+    for k in range(0, len(starts), buffer_blocks):
+        blocks = np.sort(starts[k:k+buffer_blocks])
+        d_buf = np.concatenate([d_left] + [data[b:b+block_size] for b in blocks])
+        t_buf = np.concatenate([t_left] + [target[b:b+block_size] for b in blocks])
+        perm = np.random.permutation(len(d_buf))
+        d_buf, t_buf = d_buf[perm], t_buf[perm]
+        n_full = (len(d_buf)//batch_size)*batch_size
+        for i in range(0, n_full, batch_size):
+            yield d_buf[i:i+batch_size], t_buf[i:i+batch_size]
+        d_left, t_left = d_buf[n_full:], t_buf[n_full:]
+    if len(d_left) > 0:
+        yield d_left, t_left
@@ -0,0 +1,26 @@
+############################
+#crater extraction backends#
+########################################################################
+# All backends take (target, match_thresh2, minrad, maxrad) and return an array of (x,y,r) pixel coordinates.
+# 'template'          - template_match_target, exhaustive template match over all radii (default, reference)
+# 'template_pyramid'  - template_match_target with coarse-to-fine search of the large radii
+# 'template_roi'      - template_match_target restricted to windows around the connected components of the target
+# 'hough'             - hough_match_target, ring pixels vote for circle centers, candidates verified by template match
+# See benchmark_crater_extraction.py for an accuracy/speed comparison of the backends.
+
+# Backends are only imported when requested, so using one doesn't pay for the dependencies of the others.
+
+from functools import partial
+from importlib import import_module
+
+#name -> (module, function, fixed keyword arguments)
+extractors = {'template': ('utils.template_match_target', 'template_match_target', {}),
+              'template_pyramid': ('utils.template_match_target', 'template_match_target', {'pyramid':1}),
+              'template_roi': ('utils.template_match_target', 'template_match_target', {'roi':1}),
+              'hough': ('utils.hough_match_target', 'hough_match_target', {})}
+
+def get_extractor(name):
+    if name not in extractors:
+        raise ValueError("Unknown crater extractor '%s', choose from: %s"%(name, ', '.join(sorted(extractors.keys()))))
+    module, function, kwargs = extractors[name]
+    return partial(getattr(import_module(module), function), **kwargs)
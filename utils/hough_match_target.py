@@ -0,0 +1,74 @@
+#########################
+#hough circle extraction#
+########################################################################
+
+import numpy as np
+from skimage.draw import circle_perimeter
+
+from utils.template_match_target import ring_template, match_template_window, remove_duplicates
+
+def hough_match_target(target, match_thresh2=50, minrad=3, maxrad=75):
+    #Same inputs/outputs as template_match_target, but candidate circles are found by letting every ring pixel vote
+    #for the centers it could belong to (Hough circle transform). Votes are counted sparsely, only for the centers that
+    #get any, and only centers above hough_thresh are kept as candidates. No dense accumulator is built, so the cost
+    #scales with ring pixels x circumference (summed over radii), not the image area x radii.
+    #Votes don't penalize pixels inside a circle, so small circles sitting on the arcs of larger rings also collect
+    #votes. Each candidate is therefore verified with the template match correlation, computed in a small window only.
+
+    # hyperparameters, probably don't need to change
+    ring_thickness = 2       #thickness of rings for the verification templates, same as template_match_target.
+    template_thresh = 0.5    #0-1 range, if template matching probability > template_thresh, count as detection
+    hough_thresh = 0.5       #accumulator is normalized by the circumference, if votes > hough_thresh -> candidate
+    target_thresh = 0.1      #0-1 range, pixel values > target_thresh -> 1, pixel values < target_thresh -> 0
+
+    # target - can be predicted or ground truth
+    target[target >= target_thresh] = 1
+    target[target < target_thresh] = 0
+    if not target.any():
+        return np.asarray([])
+
+    # vote, keep local maxima of the best vote over radii - votes are smeared over neighboring centers/radii
+    L, W = target.shape[0], target.shape[1]
+    radii = np.linspace(minrad,maxrad,maxrad-minrad,dtype=int)
+    R = radii[-1]
+    Wp = W + 2*R                                #centers are indexed on a grid padded by maxrad, so indices stay >= 0
+    py, px = np.nonzero(target)
+    p = ((py + R)*Wp + px + R).astype(np.int32) #flat indices of the ring pixels, int32 halves the sorting time
+    centers, votes, best_r = [], [], []
+    for i, r in enumerate(radii):
+        oy, ox = circle_perimeter(0, 0, r)      #skimage, offsets of the ring pixels from the center
+        c, n = np.unique((p[:,None] - (oy*Wp + ox).astype(np.int32)[None,:]).ravel(), return_counts=True)
+        keep = n > hough_thresh*len(oy)         #votes are normalized by the circumference
+        centers.append(c[keep]); votes.append(n[keep]/float(len(oy))); best_r.append(np.zeros(keep.sum(), dtype=int)+i)
+    centers, votes, best_r = np.concatenate(centers), np.concatenate(votes), np.concatenate(best_r)
+    inside = (centers//Wp >= R) & (centers//Wp < L+R) & (centers%Wp >= R) & (centers%Wp < W+R)
+    centers, votes, best_r = centers[inside], votes[inside], best_r[inside]
+    
+    # best radius of each center (highest vote, smallest radius on ties)
+    order = np.lexsort((best_r, -votes, centers))
+    centers, votes, best_r = centers[order], votes[order], best_r[order]
+    first = np.concatenate(([True], centers[1:] != centers[:-1]))
+    centers, votes, best_r = centers[first], votes[first], best_r[first]
+    
+    # local maxima - no candidate among the 8 neighbors has more votes (non-candidates have fewer votes anyway)
+    local_max = np.ones(len(centers), dtype=bool)
+    for d in [-Wp-1, -Wp, -Wp+1, -1, 1, Wp-1, Wp, Wp+1]:
+        j = np.minimum(np.searchsorted(centers, centers+d), len(centers)-1)
+        local_max &= ~((centers[j] == centers+d) & (votes[j] > votes))
+    centers, best_r = centers[local_max], best_r[local_max]
+    index = (centers//Wp - R, centers%Wp - R)
+
+    # verify candidates (+/-1 pixel, +/-1 radius), store x,y,r
+    coords, corr = [], []
+    templates = {}
+    for y, x, i in zip(index[0], index[1], best_r):
+        for r in radii[max(i-1,0):i+2]:
+            if r not in templates:
+                templates[r] = ring_template(r, ring_thickness)
+            result = match_template_window(target, templates[r], y, x, 1)
+            cy, cx = np.unravel_index(np.argmax(result), result.shape)
+            if result[cy,cx] > template_thresh and 0 <= y+cy-1 < L and 0 <= x+cx-1 < W:
+                coords.append([x+cx-1,y+cy-1,r])
+                corr.append(np.abs(result[cy,cx]))
+
+    return remove_duplicates(coords, corr, match_thresh2)
@@ -0,0 +1,89 @@
+################
+#memory tracker#
+########################################################################
+# Records the process memory at epoch/run boundaries of a training sweep:
+# rss          - resident set size of the process (bytes)
+# graph_ops    - number of ops in the default tensorflow graph, grows if models/ops pile up between runs
+# arrays       - the largest numpy arrays reachable from python objects, as (description, bytes)
+# memory_report() summarizes the growth over a sweep, clear_keras_session() releases a model between runs.
+
+import gc
+import sys
+import os
+import numpy as np
+from collections import Counter
+
+def get_rss():
+    #current resident set size (bytes), falls back to the peak RSS where /proc isn't available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak*1024
+
+def keras_graph_ops():
+    #number of ops in the tensorflow graph, None if tensorflow hasn't been loaded (e.g. theano backend)
+    if 'tensorflow' not in sys.modules:
+        return None
+    import tensorflow as tf
+    return len(tf.get_default_graph().get_operations())
+
+def largest_arrays(n=5, min_bytes=1e6):
+    #numpy arrays don't take part in garbage collection, so look for them among the referents of the objects that do.
+    #Views are counted as the array owning the memory, memory-mapped arrays are skipped (not resident).
+    arrays = {}
+    for obj in gc.get_objects():
+        for r in gc.get_referents(obj):
+            if isinstance(r, np.ndarray):
+                while isinstance(r.base, np.ndarray):
+                    r = r.base
+                if not isinstance(r, np.memmap) and r.base is None:
+                    arrays[id(r)] = r
+    arrays = sorted([a for a in arrays.values() if a.nbytes >= min_bytes], key=lambda a: a.nbytes, reverse=True)[:n]
+    return [('%s %s'%(a.dtype, a.shape), a.nbytes) for a in arrays]
+
+def record_memory(label, mem_log=None, n_arrays=5):
+    #prints the memory at this point and appends it to mem_log (list), if given
+    gc.collect()
+    rec = {'label': label, 'rss': get_rss(), 'graph_ops': keras_graph_ops(), 'arrays': largest_arrays(n_arrays)}
+    ops = 'n/a' if rec['graph_ops'] is None else '%d'%rec['graph_ops']
+    print "memory (%s): RSS=%.1fMB, graph ops=%s, largest arrays: %s"%(label, rec['rss']/1e6, ops,
+          ', '.join(['%s=%.1fMB'%(d, b/1e6) for d, b in rec['arrays']]) or 'none > 1MB')
+    if mem_log is not None:
+        mem_log.append(rec)
+    return rec
+
+def clear_keras_session():
+    #drop the backend graph/session of the last model, so models built in later runs don't accumulate
+    if 'keras' in sys.modules:
+        from keras import backend as K
+        if hasattr(K, 'clear_session'):
+            K.clear_session()
+    gc.collect()
+
+def memory_report(mem_log, tol=0.05):
+    #RSS and graph size at every recorded boundary relative to the first, and the arrays that appeared where RSS grew
+    #(run ends are compared with the previous run end, other boundaries with the previous record).
+    #Returns True if the RSS at the end of each run stayed within a fraction tol of the first run.
+    if len(mem_log) == 0:
+        return True
+    print "##########MEMORY_REPORT##########"
+    rss0, last_end = mem_log[0]['rss'], mem_log[0]
+    for k, rec in enumerate(mem_log):
+        ops = 'n/a' if rec['graph_ops'] is None else '%d'%rec['graph_ops']
+        print "%-30s RSS=%8.1fMB (%+8.1fMB), graph ops=%s"%(rec['label'], rec['rss']/1e6, (rec['rss']-rss0)/1e6, ops)
+        ref = mem_log[max(k-1, 0)]
+        if rec['label'].startswith('end of run'):
+            ref, last_end = last_end, rec
+        if rec['rss'] - ref['rss'] > tol*rss0:
+            new = Counter(rec['arrays']) - Counter(ref['arrays'])
+            if len(new) > 0:
+                print "    new large arrays: %s"%(', '.join(['%dx %s=%.1fMB'%(c, d, b/1e6) for (d, b), c in new.items()]))
+    runs = [rec['rss'] for rec in mem_log if rec['label'].startswith('end of run')]
+    flat = len(runs) < 2 or max(runs) - runs[0] <= tol*runs[0]
+    if len(runs) >= 2:
+        print "RSS growth over %d runs: %+.1fMB (%s)"%(len(runs), (max(runs)-runs[0])/1e6, 'flat' if flat else 'NOT flat')
+    print "#################################"
+    return flat
@@ -0,0 +1,85 @@
+##################
+#prediction cache#
+########################################################################
+# Model predictions are stored as .npy files in cache_dir, named by a hash of:
+# - the model file (weights), so retraining/overwriting a model invalidates its predictions
+# - the raw input images (before rescale_and_invcolor)
+# - the inv_color/rescale settings
+# A repeated prediction is then read memory-mapped from the cache, without loading keras or the model at all.
+# The least recently used files are evicted once the cache is larger than max_gb.
+
+import os
+import glob
+import hashlib
+import numpy as np
+
+from utils.rescale_invcolor import rescale_and_invcolor
+
+CACHE_VERSION = 1           #change to invalidate all cached predictions, e.g. if the output format changes
+_model_hashes = {}          #(path, size, mtime) -> hash, so models are only hashed once per process
+
+def file_hash(path, block_size=2**20):
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime)
+    if key not in _model_hashes:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+        _model_hashes[key] = h.hexdigest()
+    return _model_hashes[key]
+
+def array_hash(data, chunk_size=64):
+    #hashed in chunks, so memory-mapped data isn't read into memory all at once
+    h = hashlib.sha1('%s %s'%(data.dtype, data.shape))
+    for i in range(0, len(data), chunk_size):
+        h.update(np.ascontiguousarray(data[i:i+chunk_size]).tobytes())
+    return h.hexdigest()
+
+def prediction_key(modelpath, data, inv_color, rescale):
+    settings = 'version=%d, inv_color=%d, rescale=%d'%(CACHE_VERSION, inv_color, rescale)
+    return hashlib.sha1(' '.join([file_hash(modelpath), array_hash(data), settings])).hexdigest()
+
+def evict(cache_dir, max_gb, keep=None):
+    #remove the least recently used predictions (by modification time, which is updated on every hit)
+    files = sorted(glob.glob('%s/*.npy'%cache_dir), key=os.path.getmtime)
+    total = sum([os.path.getsize(f) for f in files])
+    for f in files:
+        if total <= max_gb*1e9:
+            break
+        if f != keep:
+            total -= os.path.getsize(f)
+            os.remove(f)
+            print "Evicted %s from the prediction cache."%f
+
+def cached_predict(modelpath, data, inv_color, rescale, get_model=None, cache_dir='models/pred_cache', max_gb=20, batch_size=32):
+    #predictions of model modelpath on the raw images data, which are preprocessed here (data itself isn't changed).
+    #get_model - returns the (loaded) model, called only on a cache miss. Default: keras load_model(modelpath).
+    #cache_dir=None disables the cache.
+    key = None
+    if cache_dir is not None:
+        key = prediction_key(modelpath, data, inv_color, rescale)
+        cache_file = '%s/%s.npy'%(cache_dir, key)
+        if os.path.isfile(cache_file):
+            os.utime(cache_file, None)
+            print "Loaded cached predictions of %s from %s."%(modelpath, cache_file)
+            return np.load(cache_file, mmap_mode='c')     #copy-on-write, e.g. the extractors binarize in place
+
+    if get_model is None:
+        from keras.models import load_model
+        get_model = lambda: load_model(modelpath)
+    model = get_model()
+    d = rescale_and_invcolor(np.array(data, dtype='float32'), inv_color, rescale)
+    pred = model.predict(d, batch_size=batch_size)
+    if key is None:
+        return pred
+
+    #write to a temporary file first, so an interrupted write can't leave a corrupt cache entry
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    with open('%s/%s.tmp'%(cache_dir, key), 'wb') as f:
+        np.save(f, pred)
+    os.rename('%s/%s.tmp'%(cache_dir, key), cache_file)
+    evict(cache_dir, max_gb, keep=cache_file)
+    return pred
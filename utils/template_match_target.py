@@ -3,10 +3,75 @@
 ########################################################################
 
 import numpy as np
-from skimage.feature import match_template
+from skimage.feature import match_template, peak_local_max
 import cv2
 
-def template_match_target(target, match_thresh2=50, minrad=3, maxrad=75):
+from utils.crater_extractors import get_extractor
+
+def ring_template(r, ring_thickness):
+    #ring of radius r centered in an nxn array
+    n = 2*(r+ring_thickness+1)
+    template = np.zeros((n,n))
+    cv2.circle(template, (r+ring_thickness+1,r+ring_thickness+1), r, 1, ring_thickness)
+    return template
+
+def downsample_target(target, factor):
+    #max-pool a binarized target by factor, so that thin rings survive the downsampling
+    L, W = (target.shape[0]//factor)*factor, (target.shape[1]//factor)*factor
+    return target[:L,:W].reshape(L//factor, factor, W//factor, factor).max(axis=(1,3))
+
+def match_template_box(target, template, y0, y1, x0, x1):
+    #template match results for centers in [y0,y1)x[x0,x1) only, shape = (y1-y0, x1-x0).
+    #The crop just holds the template for all of these centers, clipped to the image (match_template zero pads its
+    #input, same as pad_input=True on the full target). Since match_template's correlation at a pixel only depends on
+    #the image under the template, the results are identical to the corresponding pixels of the full image match.
+    L, W = target.shape[0], target.shape[1]
+    n = template.shape[0]
+    cy0, cy1 = max(y0-n//2, 0), min(y1+n//2, L)
+    cx0, cx1 = max(x0-n//2, 0), min(x1+n//2, W)
+    crop = target[cy0:cy1,cx0:cx1]
+    
+    #centers outside the image (window partly off the edge) - extend the crop with zeros so they get a result pixel
+    pt, pb, pl, pr = max(-y0, 0), max(y1-L, 0), max(-x0, 0), max(x1-W, 0)
+    
+    #crop can't be smaller than the template, extend it with zeros on the side(s) outside of the image
+    py = max(n - (crop.shape[0]+pt+pb), 0)
+    px = max(n - (crop.shape[1]+pl+pr), 0)
+    pt, pb = pt + py*(cy0 == 0), pb + py*(cy0 != 0)
+    pl, pr = pl + px*(cx0 == 0), pr + px*(cx0 != 0)
+    if pt+pb+pl+pr > 0:
+        crop = np.pad(crop, ((pt,pb),(pl,pr)), mode='constant')
+    
+    result = match_template(crop, template, pad_input=True)
+    return result[y0-cy0+pt:y1-cy0+pt,x0-cx0+pl:x1-cx0+pl]
+
+def match_template_window(target, template, y, x, slack):
+    #template match results for centers within +/-slack of (y,x) only, shape = (2*slack+1, 2*slack+1).
+    return match_template_box(target, template, y-slack, y+slack+1, x-slack, x+slack+1)
+
+def component_boxes(target):
+    #bounding boxes (x,y,w,h) of the connected components of a binarized target
+    n, labels, stats, centroids = cv2.connectedComponentsWithStats(target.astype(np.uint8), connectivity=8)
+    return stats[1:,:4]
+
+def remove_duplicates(coords, corr, match_thresh2):
+    # remove duplicates from template matching at neighboring radii/locations
+    coords, corr = np.asarray(coords), np.asarray(corr)
+    i, N = 0, len(coords)
+    while i < N:
+        diff = (coords - coords[i])**2
+        diffsum = np.asarray([sum(x) for x in diff])
+        index = diffsum < match_thresh2
+        if len(np.where(index==True)[0]) > 1:
+            #replace current coord with max-correlation coord from duplicate list
+            coords_i, corr_i = coords[np.where(index==True)], corr[np.where(index==True)]
+            coords[i] = coords_i[corr_i == np.max(corr_i)][0]
+            index[i] = False
+            coords, corr = coords[np.where(index==False)], corr[np.where(index==False)]
+        N, i = len(coords), i+1
+    return coords
+
+def template_match_target(target, match_thresh2=50, minrad=3, maxrad=75, pyramid=0, pyramid_factor=2, pyramid_minrad=20, roi=0):
     #Match Threshold (squared)
     # for template matching, if (x1-x2)^2 + (y1-y2)^2 + (r1-r2)^2 < match_thresh2, remove (x2,y2,r2) circle (it is a duplicate).
     # for predicted target -> csv matching, if (x1-x2)^2 + (y1-y2)^2 + (r1-r2)^2 < match_thresh2, positive detection
@@ -14,23 +79,47 @@ def template_match_target(target, match_thresh2=50, minrad=3, maxrad=75):
     #minrad - keep in mind that if the predicted target has thick rings, a small ring of diameter ~ ring thickness could be detected by match_filter.
     
     # minrad/maxrad are the radii to search over during template matching
+    
+    #pyramid - 1 = radii >= pyramid_minrad are first searched on a target downsampled by pyramid_factor, and only the
+    #candidates found there are refined at full resolution in small windows. Radii < pyramid_minrad are searched exhaustively.
+    #See benchmark_crater_extraction.py for the recall/speed tradeoff vs. the exhaustive search (pyramid=0).
+    
+    #roi - 1 = each radius r is only matched in windows around the connected components of the binarized target whose
+    #bounding box is at least r wide or high, padded by r (+ring thickness) so the centers of arcs are included,
+    #instead of over the full image. Rings broken into pieces that are all smaller than r can be missed.
+    #Cost then scales with the crater content of the image rather than the image size.
+    
     # hyperparameters, probably don't need to change
     ring_thickness = 2       #thickness of rings for the templates. 2 seems to work well.
     template_thresh = 0.5    #0-1 range, if template matching probability > template_thresh, count as detection
     target_thresh = 0.1      #0-1 range, pixel values > target_thresh -> 1, pixel values < target_thresh -> 0
+    coarse_thresh = 0.3      #0-1 range, (lower) template_thresh used on the downsampled target, so candidates aren't missed
     
     # target - can be predicted or ground truth
     target[target >= target_thresh] = 1
     target[target < target_thresh] = 0
+    if not target.any():
+        return np.asarray([])       #nothing to match on an empty target
     
     radii = np.linspace(minrad,maxrad,maxrad-minrad,dtype=int)
+    if roi == 1:
+        boxes = component_boxes(target)
+    if pyramid == 1:
+        coarse_radii = radii[radii >= pyramid_minrad]
+        radii = radii[radii < pyramid_minrad]
+    
     coords = []     #coordinates extracted from template matching
     corr = []       #correlation coefficient for coordinates set
     for r in radii:
         # template
-        n = 2*(r+ring_thickness+1)
-        template = np.zeros((n,n))
-        cv2.circle(template, (r+ring_thickness+1,r+ring_thickness+1), r, 1, ring_thickness)
+        template = ring_template(r, ring_thickness)
+        
+        if roi == 1:
+            margin = r + ring_thickness + 1     #the center of a partial ring (arc) can lie up to r outside its box
+            coords_r, corr_r = roi_match_target(target, template, boxes[np.maximum(boxes[:,2], boxes[:,3]) >= r], margin, template_thresh)
+            coords += [[c[0],c[1],r] for c in coords_r]
+            corr += corr_r
+            continue
         
         # template match - result is nxn array of probabilities
         result = match_template(target, template, pad_input=True)   #skimage
@@ -44,32 +133,76 @@ def template_match_target(target, match_thresh2=50, minrad=3, maxrad=75):
         for l in corr_r:
             corr.append(np.abs(l))
 
-    # remove duplicates from template matching at neighboring radii/locations
-    coords, corr = np.asarray(coords), np.asarray(corr)
-    i, N = 0, len(coords)
-    while i < N:
-        diff = (coords - coords[i])**2
-        diffsum = np.asarray([sum(x) for x in diff])
-        index = diffsum < match_thresh2
-        if len(np.where(index==True)[0]) > 1:
-            #replace current coord with max-correlation coord from duplicate list
-            coords_i, corr_i = coords[np.where(index==True)], corr[np.where(index==True)]
-            coords[i] = coords_i[corr_i == np.max(corr_i)][0]
-            index[i] = False
-            coords = coords[np.where(index==False)]
-        N, i = len(coords), i+1
+    if pyramid == 1 and len(coarse_radii) > 0:
+        coords_p, corr_p = pyramid_match_target(target, coarse_radii, pyramid_factor, ring_thickness, template_thresh, coarse_thresh)
+        coords += coords_p
+        corr += corr_p
 
-    return coords
+    return remove_duplicates(coords, corr, match_thresh2)
+
+def roi_match_target(target, template, boxes, margin, template_thresh):
+    #template match a single radius on an already binarized target, only for centers inside the (x,y,w,h) boxes
+    #padded by margin. Returns (x,y) coordinates and correlations, overlapping boxes are only counted once.
+    L, W = target.shape[0], target.shape[1]
+    matches = {}
+    
+    #dense targets - if the windows cover more than the image, a single full image match is cheaper
+    n = template.shape[0]
+    if np.sum(np.minimum(boxes[:,2]+2*margin+n, W)*np.minimum(boxes[:,3]+2*margin+n, L)) >= L*W:
+        boxes = [(0, 0, W, L)]
+        margin = 0
+    for bx, by, bw, bh in boxes:
+        y0, y1 = max(by-margin, 0), min(by+bh+margin, L)
+        x0, x1 = max(bx-margin, 0), min(bx+bw+margin, W)
+        result = match_template_box(target, template, y0, y1, x0, x1)
+        index_r = np.where(result > template_thresh)
+        for cy, cx in zip(*index_r):
+            matches[(cx+x0, cy+y0)] = np.abs(result[cy,cx])
+    return matches.keys(), matches.values()
+
+def pyramid_match_target(target, radii, factor, ring_thickness, template_thresh, coarse_thresh):
+    #coarse-to-fine search over radii on an already binarized target.
+    #1) match rings of radius r/factor on the max-pooled target -> candidate centers
+    #2) match radii within +/-factor of each candidate at full resolution, in a window just big enough to hold the template
+    #   (see match_template_window), giving the same correlations as the exhaustive search at the refined locations.
+    L, W = target.shape[0], target.shape[1]
+    target_c = downsample_target(target, factor)
+    
+    candidates = {}      #full-resolution radius -> list of candidate (y,x) centers
+    for rc in np.unique(np.round(radii/float(factor)).astype(int)):
+        result = match_template(target_c, ring_template(rc, 1), pad_input=True)
+        peaks = peak_local_max(result, min_distance=1, threshold_abs=coarse_thresh, exclude_border=False)
+        if len(peaks) == 0:
+            continue
+        for r in radii[np.abs(radii - rc*factor) <= factor]:
+            candidates.setdefault(r, []).extend([(p[0]*factor, p[1]*factor) for p in peaks])
+
+    matches = {}        #(x,y,r) -> correlation, refined windows can overlap
+    slack = factor + 1  #positional uncertainty of a coarse candidate (full resolution pixels)
+    for r, centers in candidates.items():
+        template = ring_template(r, ring_thickness)
+        for y, x in set(centers):
+            result = match_template_window(target, template, y, x, slack)
+            index_r = np.where(result > template_thresh)
+            for cy, cx in zip(*index_r):
+                if 0 <= cy+y-slack < L and 0 <= cx+x-slack < W:
+                    matches[(cx+x-slack, cy+y-slack, r)] = np.abs(result[cy,cx])
+
+    coords, corr = [], []
+    for c, l in matches.items():
+        coords.append(list(c))
+        corr.append(l)
+    return coords, corr
 
 
-def template_match_target_to_csv(target, csv_coords, minrad=3, maxrad=75):
+def template_match_target_to_csv(target, csv_coords, minrad=3, maxrad=75, extractor='template'):
     #Match Threshold (squared)
     # for template matching, if (x1-x2)^2 + (y1-y2)^2 + (r1-r2)^2 < match_thresh2, remove (x2,y2,r2) circle (it is a duplicate).
     # for predicted target -> csv matching, if (x1-x2)^2 + (y1-y2)^2 + (r1-r2)^2 < match_thresh2, positive detection
     match_thresh2 = 50
     
-    #get coordinates from template matching
-    templ_coords = template_match_target(target, match_thresh2, minrad, maxrad)
+    #get coordinates from template matching (or another backend, see utils/crater_extractors.py)
+    templ_coords = get_extractor(extractor)(target, match_thresh2, minrad, maxrad)
 
     # compare template-matched results to "ground truth" csv input data
     N_match = 0
@@ -0,0 +1,68 @@
+#####################################
+#unet parameter/FLOP/memory estimate#
+########################################################################
+# Estimates the size/cost of utils/unet_model.unet_model *without* building it (no keras needed), so that a
+# configuration can be checked against memory/latency budgets before training, e.g. in a parameter sweep.
+
+def unet_widths(n_filters, depth, width_mult):
+    #number of filters at each pooling level, doubling every level (level 0 = full resolution)
+    nf = max(int(round(n_filters*width_mult)), 1)
+    return [nf*2**k for k in range(depth)]
+
+def conv_cost(FL, c_in, c_out, separable):
+    #(parameters, multiply-adds per output pixel) of a 'same' convolution
+    if separable == 1:
+        weights = FL*FL*c_in + c_in*c_out       #depthwise + pointwise
+    else:
+        weights = FL*FL*c_in*c_out
+    return weights + c_out, weights
+
+def estimate_unet(dim, FL, n_filters, depth=3, width_mult=1., separable=0, drop=0, batch_size=32, bytes_per_float=4):
+    #returns a dict with:
+    #params             - number of trainable parameters
+    #flops              - floating point operations (2 x multiply-adds) of the convolutions, per dim x dim image
+    #activation_bytes   - memory of all layer outputs for a batch, i.e. what's kept for backprop during training
+    #param_bytes        - memory of weights + gradients + Adam moments (4 copies)
+    widths = unet_widths(n_filters, depth, width_mult)
+    params, macs, acts = 0, 0, dim*dim*1       #acts counts floats of layer outputs per image, starting with the input
+
+    def add_conv(size, c_in, c_out, sep):
+        p, m = conv_cost(FL, c_in, c_out, sep)
+        return p, m*size*size, size*size*(c_out + c_in*sep)    #separable convs also keep the depthwise output
+
+    # contracting path: 2 convs + maxpool per level
+    size, c = dim, 1
+    for w in widths:
+        for c_in in [c, w]:
+            p, m, a = add_conv(size, c_in, w, separable)
+            params, macs, acts = params+p, macs+m, acts+a
+        size, c = size//2, w
+        acts += size*size*c
+
+    # bottleneck: 2 convs at the widest level
+    for c_in in [c, widths[-1]]:
+        p, m, a = add_conv(size, c_in, widths[-1], separable)
+        params, macs, acts = params+p, macs+m, acts+a
+    c = widths[-1]
+
+    # expanding path: upsample, concatenate with the skip connection, (dropout), 2 convs per level
+    for w in reversed(widths):
+        size = size*2
+        acts += size*size*c + size*size*(c+w)*(1 + (drop > 0))
+        for c_in in [c+w, w]:
+            p, m, a = add_conv(size, c_in, w, separable)
+            params, macs, acts = params+p, macs+m, acts+a
+        c = w
+
+    # final 1x1 sigmoid output
+    p, m = conv_cost(1, c, 1, 0)
+    params, macs, acts = params+p, macs+m*dim*dim, acts+dim*dim
+
+    return {'params': params,
+            'flops': 2*macs,
+            'activation_bytes': acts*batch_size*bytes_per_float,
+            'param_bytes': 4*params*bytes_per_float}
+
+def print_unet_estimate(est):
+    print 'params=%.2fM, GFLOPs/image=%.2f, activations/batch=%.2fGB, weights+grads+Adam=%.2fGB'%(est['params']/1e6,
+          est['flops']/1e9, est['activation_bytes']/1e9, est['param_bytes']/1e9)
@@ -0,0 +1,59 @@
+##########################
+#unet model (keras 1.2.2)#
+########################################################################
+#Following https://arxiv.org/pdf/1505.04597.pdf
+#and this for merging specifics: https://gist.github.com/Neltherion/f070913fd6284c4a0b60abb86a0cd642
+#depth      - number of pooling levels (3 = original model)
+#width_mult - multiplies n_filters, the number of filters at full resolution. Filters double every level.
+#separable  - 1 = use depthwise separable convolutions (except for the final 1x1 output), far fewer params/FLOPs
+#drop       - dropout after each merge layer, 0 = no dropout layers
+#Use utils/unet_estimate.py to get the params/FLOPs/memory of a configuration without building it.
+
+from keras.models import Model
+from keras.layers.core import Dropout, Reshape
+from keras.layers import merge, Input
+from keras.layers.convolutional import Convolution2D, SeparableConvolution2D, MaxPooling2D, UpSampling2D
+from keras.regularizers import l2
+from keras.optimizers import Adam
+
+from utils.unet_estimate import unet_widths
+
+def unet_model(dim,learn_rate,lmbda,drop,FL,init,n_filters,depth=3,width_mult=1.,separable=0):
+    print('Making UNET model...')
+    img_input = Input(batch_shape=(None, dim, dim, 1))
+
+    def conv(nf, x):
+        if separable == 1:
+            return SeparableConvolution2D(nf, FL, FL, activation='relu', init=init, depthwise_regularizer=l2(lmbda), pointwise_regularizer=l2(lmbda), border_mode='same')(x)
+        return Convolution2D(nf, FL, FL, activation='relu', init=init, W_regularizer=l2(lmbda), border_mode='same')(x)
+
+    #contracting path
+    widths = unet_widths(n_filters, depth, width_mult)
+    u, skips = img_input, []
+    for nf in widths:
+        a = conv(nf, conv(nf, u))
+        skips.append(a)
+        u = MaxPooling2D((2, 2), strides=(2, 2))(a)
+
+    u = conv(widths[-1], conv(widths[-1], u))
+
+    #expanding path
+    for nf, a in reversed(zip(widths, skips)):
+        u = UpSampling2D((2,2))(u)
+        u = merge((a, u), mode='concat', concat_axis=3)
+        if drop > 0:
+            u = Dropout(drop)(u)
+        u = conv(nf, conv(nf, u))
+
+    #final output
+    final_activation = 'sigmoid'       #sigmoid, relu
+    u = Convolution2D(1, 1, 1, activation=final_activation, init=init, W_regularizer=l2(lmbda), name='output', border_mode='same')(u)
+    u = Reshape((dim, dim))(u)
+    model = Model(input=img_input, output=u)
+    
+    #optimizer/compile
+    optimizer = Adam(lr=learn_rate, beta_1=0.9, beta_2=0.999, epsilon=1e-08, decay=0.0)
+    model.compile(loss='binary_crossentropy', optimizer=optimizer)  #binary cross-entropy severely penalizes opposite predictions.
+    print model.summary()
+
+    return model